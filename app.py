@@ -5,24 +5,51 @@ from functools import wraps
 try:
     import eventlet
     eventlet.monkey_patch()
+    from eventlet import tpool
+    from eventlet.greenpool import GreenPool
 except Exception:
-    pass
-from sqlalchemy import inspect, text
-
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
+    tpool = None
+    GreenPool = None
+# after monkey_patch, so locks and pool threads are the green versions under eventlet
+import time
+import threading
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+from sqlalchemy import event, inspect, text, select, insert, delete, func, case, lambda_stmt, bindparam
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload
+
+from flask import Flask, render_template, stream_template, get_flashed_messages, request, redirect, url_for, session, flash, jsonify, send_from_directory
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 
 from flask_socketio import SocketIO, emit, join_room, leave_room
 
 from models import db, User, Donor, BloodRequest, Notification
-from matching import find_best_donors, canonical_blood, haversine_distance
+from matching import CAN_DONATE_TO, find_best_donors, canonical_blood, haversine_distances, compute_age_from_dob, invalidate_donor_cache, update_cached_donor, \
+    open_requests_within, invalidate_open_requests
 
 # Twilio optional
 try:
     from twilio.rest import Client as TwilioClient
+    from twilio.base.exceptions import TwilioRestException
 except Exception:
     TwilioClient = None
+    TwilioRestException = None
+
+# orjson optional: faster encoding for the large JSON endpoints
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+# argon2-cffi optional: argon2id for new password hashes, werkzeug hashes still verify
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHash
+except Exception:
+    PasswordHasher = None
 
 import smtplib
 from email.mime.text import MIMEText
@@ -36,23 +63,103 @@ app = Flask(__name__, static_folder="static", template_folder="templates")
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret-key")
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL") or f"sqlite:///{DB_FILE}"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+if app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgres"):
+    # psycopg2: rewrite executemany() into multi-row VALUES / execute_batch pages
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "executemany_mode": "values_plus_batch",
+        "executemany_batch_page_size": 500,
+        "pool_pre_ping": True,
+        # many concurrent socket handlers + HTTP requests per worker; the default 5+10 makes them queue
+        "pool_size": 20,
+        "max_overflow": 40,
+        "pool_recycle": 1800,
+    }
 app.config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "static", "uploads")
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 ALLOWED_EXT = {"png", "jpg", "jpeg", "gif"}
 
 db.init_app(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # local/dev fallback DB: WAL lets readers run alongside the writer, NORMAL drops the per-commit double fsync
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cur = dbapi_connection.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    # socket handlers and the position flusher write concurrently: wait for the lock instead of failing
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA mmap_size=268435456")
+    cur.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache per connection (default is ~2 MiB)
+    cur.close()
+
+# eventlet is monkey-patched above, so serve sockets on its hub; plain threads only if it isn't installed
+ASYNC_MODE = "eventlet" if tpool is not None else "threading"
+
+# REDIS_URL lets several worker processes share Socket.IO rooms (emits fan out over pub/sub)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, message_queue=os.getenv("REDIS_URL"))
 
 MIN_AGE = 18
 MAX_AGE = 65
 MIN_WEIGHT_KG = 50.0
 MIN_DAYS_SINCE_LAST_DONATION = 90
+REQUESTS_PAGE_SIZE = 50
+DONORS_PAGE_SIZE = 50
+
+# argon2id at the OWASP baseline (19 MiB, t=2, p=1): cheaper per verify than werkzeug's
+# scrypt/pbkdf2 defaults for comparable strength
+_argon2 = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1) if PasswordHasher else None
 
-def compute_age_from_dob(dob):
-    if not dob:
-        return None
-    today = date.today()
-    return today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+def _generate_hash(pwd):
+    return _argon2.hash(pwd) if _argon2 else generate_password_hash(pwd)
+
+def _check_hash(pw_hash, pwd):
+    # dispatch on the stored format, so accounts created before argon2 keep logging in
+    if pw_hash.startswith("$argon2"):
+        if _argon2 is None:
+            return False
+        try:
+            return _argon2.verify(pw_hash, pwd)
+        except (VerificationError, InvalidHash):
+            return False
+    return check_password_hash(pw_hash, pwd)
+
+# hashing is pure CPU: under eventlet run it on a real OS thread so the hub keeps serving sockets
+def hash_password(pwd):
+    if tpool is not None:
+        return tpool.execute(_generate_hash, pwd)
+    return _generate_hash(pwd)
+
+# successful checks are remembered so repeat logins skip the hash; keyed on the stored hash (a password
+# change misses) and a BLAKE2 of the attempt under a per-process random key (no plaintext kept)
+VERIFIED_LOGINS_MAX = 1024
+
+_verified_logins = OrderedDict()
+_verified_lock = threading.Lock()
+_verify_key = os.urandom(32)
+
+def verify_password(pw_hash, pwd):
+    key = (pw_hash, hashlib.blake2b(pwd.encode(), key=_verify_key).digest())
+    with _verified_lock:
+        if key in _verified_logins:
+            _verified_logins.move_to_end(key)
+            return True
+    if tpool is not None:
+        ok = tpool.execute(_check_hash, pw_hash, pwd)
+    else:
+        ok = _check_hash(pw_hash, pwd)
+    if ok:
+        with _verified_lock:
+            _verified_logins[key] = True
+            if len(_verified_logins) > VERIFIED_LOGINS_MAX:
+                _verified_logins.popitem(last=False)
+    return ok
+
+def donor_session_snapshot(d):
+    # the few fields the donor pages render; saves a Donor lookup per page view
+    return {"id": d.id, "name": d.name, "blood_group": d.blood_group, "residential_area": d.residential_area}
 
 def login_required(role=None):
     def decorator(f):
@@ -77,40 +184,170 @@ def donor_login_required(f):
         return f(*args, **kwargs)
     return wrapped
 
+_twilio_client = None
+_twilio_lock = threading.Lock()
+
+def get_twilio_client(sid, token):
+    # one client (and its HTTP session) per process instead of one per SMS;
+    # locked because the SMS pool's first burst would otherwise race to build several
+    global _twilio_client
+    if _twilio_client is None:
+        with _twilio_lock:
+            if _twilio_client is None:
+                _twilio_client = TwilioClient(sid, token)
+    return _twilio_client
+
+def twilio_configured():
+    return bool(os.getenv("TWILIO_SID") and os.getenv("TWILIO_TOKEN") and os.getenv("TWILIO_PHONE") and TwilioClient)
+
+def _sms_error_is_transient(e):
+    # REST errors carry Twilio's HTTP status: only rate limiting and server errors can succeed later;
+    # a 4xx (invalid/unverified number, bad credentials) fails the same way on every retry
+    if TwilioRestException is not None and isinstance(e, TwilioRestException):
+        return e.status == 429 or e.status >= 500
+    # anything else is the HTTP call itself failing (connection reset, timeout, DNS)
+    return True
+
 def send_sms_twilio(phone, message):
+    # True when sent, False when mocked or rejected for good; raises on transient errors so the caller can retry
     sid = os.getenv("TWILIO_SID")
     token = os.getenv("TWILIO_TOKEN")
     from_num = os.getenv("TWILIO_PHONE")
-    if not (sid and token and from_num and TwilioClient):
+    if not twilio_configured():
         print("[SMS MOCK] ->", phone, message)
         return False
     try:
-        client = TwilioClient(sid, token)
+        client = get_twilio_client(sid, token)
         client.messages.create(from_=from_num, to=phone, body=message)
         return True
     except Exception as e:
+        if _sms_error_is_transient(e):
+            raise
         print("Twilio error:", e)
         return False
 
+# long-lived SMTP session: the TLS handshake + LOGIN is paid once, not per email
+_smtp = None
+_smtp_lock = threading.Lock()
+
+def _smtp_connection(user, pwd):
+    global _smtp
+    if _smtp is None:
+        conn = smtplib.SMTP_SSL("smtp.gmail.com", 465)
+        conn.login(user, pwd)
+        _smtp = conn
+    return _smtp
+
+def _smtp_reset():
+    global _smtp
+    if _smtp is not None:
+        try:
+            _smtp.close()
+        except Exception:
+            pass
+    _smtp = None
+
 def send_email_smtp(to_email, subject, body):
     user = os.getenv("SMTP_USER")
     pwd = os.getenv("SMTP_PASS")
     if not (user and pwd):
         print("[EMAIL MOCK] ->", to_email, subject, body)
         return False
-    try:
-        msg = MIMEText(body)
-        msg["From"] = user
-        msg["To"] = to_email
-        msg["Subject"] = subject
-        s = smtplib.SMTP_SSL("smtp.gmail.com", 465)
-        s.login(user, pwd)
-        s.sendmail(user, [to_email], msg.as_string())
-        s.quit()
-        return True
-    except Exception as e:
-        print("SMTP error:", e)
-        return False
+    msg = MIMEText(body)
+    msg["From"] = user
+    msg["To"] = to_email
+    msg["Subject"] = subject
+    with _smtp_lock:
+        for attempt in range(2):
+            try:
+                _smtp_connection(user, pwd).sendmail(user, [to_email], msg.as_string())
+                return True
+            except smtplib.SMTPServerDisconnected as e:
+                # server dropped the idle session: reconnect once
+                _smtp_reset()
+                if attempt:
+                    print("SMTP error:", e)
+            except Exception as e:
+                _smtp_reset()
+                print("SMTP error:", e)
+                return False
+    return False
+
+# caps concurrent Twilio calls per process: green threads under eventlet, a small thread pool otherwise
+if GreenPool is not None:
+    _sms_pool = GreenPool(32)
+    _spawn_sms = _sms_pool.spawn_n
+else:
+    _sms_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sms")
+    _spawn_sms = _sms_pool.submit
+
+SMS_MAX_RETRIES = 3  # transient Twilio failures (network, 429, 5xx) retry after 1s, 2s, 4s
+
+def _send_sms_safe(phone, message):
+    for attempt in range(SMS_MAX_RETRIES + 1):
+        try:
+            # a False return (mock or permanent rejection) is final; only a raise is retried
+            send_sms_twilio(phone, message)
+            return
+        except Exception as e:
+            print("SMS batch error:", phone, e)
+        if attempt < SMS_MAX_RETRIES:
+            # green sleep under eventlet; otherwise only this pool worker waits
+            time.sleep(2 ** attempt)
+    print("SMS gave up:", phone)
+
+def send_sms_batch(phones, message):
+    # Twilio round-trips never run on the request path, and go out concurrently on the pool
+    for phone in phones:
+        _spawn_sms(_send_sms_safe, phone, message)
+
+def insert_missing_notifications(request_id, donor_ids, notif_type, payload):
+    # one IN query for who already has this request, one executemany for everyone else
+    if not donor_ids:
+        return []
+    existing = {row[0] for row in db.session.query(Notification.donor_id).filter(
+        Notification.request_id == request_id, Notification.donor_id.in_(donor_ids))}
+    new_ids = [i for i in donor_ids if i not in existing]
+    if new_ids:
+        db.session.execute(Notification.__table__.insert(), [
+            {"donor_id": i, "request_id": request_id, "notif_type": notif_type, "payload": payload} for i in new_ids])
+    return new_ids
+
+# short-lived cache of the notification tails shown on / and the donor dashboard
+NOTIFICATION_TAIL_TTL = 5  # seconds; inserts in this process clear it sooner
+NOTIFICATION_TAILS_MAX = 1024  # one entry per donor dashboard; expired ones are swept at the cap
+
+_notification_tails = {}  # (donor_id or None for all, limit) -> (expires, rows)
+
+def recent_notifications(donor_id=None, limit=20):
+    key = (donor_id, limit)
+    now = time.monotonic()
+    hit = _notification_tails.get(key)
+    if hit and now < hit[0]:
+        return hit[1]
+    # plain rows, not ORM objects, so they are safe to hand to later requests
+    query = select(Notification.created_at, Notification.payload)
+    if donor_id is not None:
+        query = query.where(Notification.donor_id == donor_id)
+    rows = db.session.execute(query.order_by(Notification.created_at.desc()).limit(limit)).all()
+    if len(_notification_tails) >= NOTIFICATION_TAILS_MAX:
+        for k, (expires, _) in list(_notification_tails.items()):
+            if expires <= now:
+                _notification_tails.pop(k, None)
+        if len(_notification_tails) >= NOTIFICATION_TAILS_MAX:
+            # all still live: start over rather than grow
+            _notification_tails.clear()
+    _notification_tails[key] = (now + NOTIFICATION_TAIL_TTL, rows)
+    return rows
+
+def invalidate_notifications():
+    _notification_tails.clear()
+
+def stream_page(template_name, **context):
+    # base.html pops flashes from the session; do it before the first chunk goes out,
+    # since the session cookie can't be rewritten once streaming has started
+    get_flashed_messages()
+    return app.response_class(stream_template(template_name, **context))
 
 def is_donor_eligible(d: Donor):
     if not d.is_available:
@@ -148,9 +385,9 @@ def index():
     if user_role == "donor":
         donor_id = session.get("donor_id")
         if donor_id:
-            notif_list = Notification.query.filter_by(donor_id=donor_id).order_by(Notification.created_at.desc()).limit(20).all()
+            notif_list = recent_notifications(donor_id)
     elif user_role in ("admin", "hospital"):
-        notif_list = Notification.query.order_by(Notification.created_at.desc()).limit(20).all()
+        notif_list = recent_notifications()
     return render_template("index.html", notifications=notif_list)
 
 @app.route("/uploads/<path:filename>")
@@ -164,7 +401,7 @@ def login():
         identifier = request.form.get("identifier", "").strip()
         pwd = request.form.get("password", "")
         u = User.query.filter_by(username=identifier).first()
-        if u and check_password_hash(u.password_hash, pwd):
+        if u and verify_password(u.password_hash, pwd):
             session.clear()
             session["user_id"] = u.id
             session["username"] = u.username
@@ -173,12 +410,14 @@ def login():
             if u.role == "admin":
                 return redirect(url_for("admin_dashboard"))
             return redirect(url_for("request_blood"))
+        # no staff match (or wrong staff password): the identifier may be a donor's phone
         d = Donor.query.filter_by(phone=identifier).first()
-        if d and d.password_hash and check_password_hash(d.password_hash, pwd):
+        if d and d.password_hash and verify_password(d.password_hash, pwd):
             session.clear()
             session["user_role"] = "donor"
             session["donor_id"] = d.id
             session["donor_name"] = d.name
+            session["donor"] = donor_session_snapshot(d)
             flash("Logged in as donor.", "info")
             return redirect(url_for("donor_dashboard"))
         error = "Invalid credentials"
@@ -186,8 +425,7 @@ def login():
 
 @app.route("/logout")
 def logout():
-    for k in list(session.keys()):
-        session.pop(k, None)
+    session.clear()
     flash("Logged out.", "info")
     return redirect(url_for("index"))
 
@@ -196,7 +434,8 @@ def register_donor():
     error = None
     if request.method == "POST":
         name = request.form.get("name", "").strip()
-        blood = request.form.get("blood_group", "").strip().upper()
+        # stored canonical so matching can compare the column as-is
+        blood = canonical_blood(request.form.get("blood_group", "").strip())
         phone = request.form.get("phone", "").strip()
         password = request.form.get("password", "").strip()
         dob_str = request.form.get("dob", "").strip()
@@ -210,7 +449,7 @@ def register_donor():
             error = "Please fill name, blood group, phone and password."
             return render_template("register_donor.html", error=error)
 
-        if Donor.query.filter_by(phone=phone).first():
+        if db.session.query(Donor.query.filter_by(phone=phone).exists()).scalar():
             error = "Phone already registered."
             return render_template("register_donor.html", error=error)
 
@@ -242,9 +481,10 @@ def register_donor():
             last_seen=datetime.utcnow(),
             residential_area=residential_area
         )
-        d.password_hash = generate_password_hash(password)
+        d.password_hash = hash_password(password)
         db.session.add(d)
         db.session.commit()
+        invalidate_admin_counts()
         flash("Registration successful. Please login.", "info")
         return redirect(url_for("login"))
     return render_template("register_donor.html", error=error)
@@ -265,17 +505,16 @@ def register_hospital():
             return render_template("register_hospital.html", error=error, form=request.form)
 
         # check if username already used
-        if User.query.filter_by(username=username).first():
+        if db.session.query(User.query.filter_by(username=username).exists()).scalar():
             error = "Username already taken."
             return render_template("register_hospital.html", error=error, form=request.form)
 
         # create user with role 'hospital'
         try:
-            from werkzeug.security import generate_password_hash
             u = User(
                 username=username,
                 role="hospital",
-                password_hash=generate_password_hash(password)
+                password_hash=hash_password(password)
             )
 
             # optional fields if your User model supports them (avoid if not)
@@ -301,27 +540,22 @@ def register_hospital():
 @app.route("/donor/dashboard")
 @donor_login_required
 def donor_dashboard():
-    d = Donor.query.get(session["donor_id"])
-    notifications = Notification.query.filter_by(donor_id=d.id).order_by(Notification.created_at.desc()).limit(50).all()
-    assigned = BloodRequest.query.filter_by(accepted_donor_id=d.id).order_by(BloodRequest.created_at.desc()).all()
-
-    # Compute initial available requests for donor (ranked by find_best_donors if donor has location)
-    available_requests = []
-    try:
-        if d and d.latitude is not None and d.longitude is not None:
-            ranked = find_best_donors(d.blood_group, d.latitude, d.longitude, max_results=20)
-            for donor_obj, dist, score in ranked:
-                # The find_best_donors returns donors; we actually need request objects.
-                # Instead fetch open requests and compute distance below.
-                pass
-    except Exception:
-        # ignore, will fetch via API on client
-        pass
+    donor = session.get("donor")
+    if not donor:
+        # session from before login stored the snapshot
+        d = Donor.query.get(session["donor_id"])
+        if not d:
+            session.clear()
+            flash("Please login as donor.", "error")
+            return redirect(url_for("login"))
+        donor = session["donor"] = donor_session_snapshot(d)
+    notifications = recent_notifications(donor["id"], limit=50)
+    assigned = BloodRequest.query.filter_by(accepted_donor_id=donor["id"]).order_by(BloodRequest.created_at.desc()).all()
 
     # We'll let client fetch available requests dynamically via /api/available_requests
     return render_template(
         "donor_dashboard.html",
-        donor=d,
+        donor=donor,
         notifications=notifications,
         assigned_requests=assigned,
         available_requests=[],
@@ -331,18 +565,28 @@ def donor_dashboard():
 @app.route("/api/available_requests")
 @donor_login_required
 def api_available_requests():
-    donor = Donor.query.get(session["donor_id"])
-    if not donor or donor.latitude is None or donor.longitude is None:
+    # only the position is needed; a just-shared one may still be waiting for flush_positions
+    donor_id = session["donor_id"]
+    pending = peek_pending_position(donor_id)
+    if pending:
+        lat, lon = pending[0], pending[1]
+    else:
+        # polled every few seconds per dashboard: lambda_stmt skips rebuilding the statement each time
+        row = db.session.execute(lambda_stmt(lambda: select(Donor.latitude, Donor.longitude).where(Donor.id == donor_id))).first()
+        lat, lon = row if row else (None, None)
+    if lat is None or lon is None:
         return jsonify([])
 
-    # Fetch open requests and compute distance
-    open_requests = BloodRequest.query.filter(BloodRequest.status == "OPEN").all()
+    # Fetch open requests and compute every distance in one vectorised pass
+    open_requests = db.session.execute(lambda_stmt(lambda:
+        select(BloodRequest.id, BloodRequest.patient_name, BloodRequest.required_blood_group,
+               BloodRequest.latitude, BloodRequest.longitude, BloodRequest.created_at).where(BloodRequest.status == "OPEN")
+    )).all()
+    if not open_requests:
+        return jsonify([])
+    dists = haversine_distances(lat, lon, [br.latitude for br in open_requests], [br.longitude for br in open_requests])
     out = []
-    for br in open_requests:
-        try:
-            dist = haversine_distance(donor.latitude, donor.longitude, br.latitude, br.longitude)
-        except Exception:
-            dist = None
+    for br, dist in zip(open_requests, dists.tolist()):
         out.append({
             "id": br.id,
             "patient_name": br.patient_name,
@@ -350,18 +594,17 @@ def api_available_requests():
             "latitude": br.latitude,
             "longitude": br.longitude,
             "created_at": br.created_at.isoformat() if br.created_at else None,
-            "distance_km": round(dist, 3) if dist is not None else None
+            "distance_km": round(dist, 3)
         })
 
-    # sort by distance (None last)
-    out_sorted = sorted([o for o in out if o["distance_km"] is not None], key=lambda x: x["distance_km"]) + \
-                 [o for o in out if o["distance_km"] is None]
-    return jsonify(out_sorted)
+    out.sort(key=lambda x: x["distance_km"])
+    return jsonify(out)
 
 @app.route("/donor/logout")
 def donor_logout():
     session.pop("donor_id", None)
     session.pop("donor_name", None)
+    session.pop("donor", None)
     session.pop("user_role", None)
     flash("Logged out.", "info")
     return redirect(url_for("index"))
@@ -383,43 +626,23 @@ def request_blood():
             return render_template("request_blood.html", error=error, matches=[], rejected=[], form={})
 
         top_k = int(request.form.get("top_k", 10))
-        br = BloodRequest(
-            patient_name=patient,
-            required_blood_group=blood,
-            latitude=latf,
-            longitude=lonf,
-            status="OPEN",
-            created_by=session.get("user_id"),
-        )
-        db.session.add(br)
-        db.session.commit()
-
-        ranked = find_best_donors(br.required_blood_group, br.latitude, br.longitude, max_results=top_k)
-
-        notified = []
-        for d, dist, score in ranked:
-            existing = Notification.query.filter_by(donor_id=d.id, request_id=br.id).first()
-            if existing:
-                continue
-            msg_payload = f"URGENT: Blood needed ({br.required_blood_group}) for {br.patient_name} near your area."
-            notif = Notification(donor_id=d.id, request_id=br.id, notif_type="REQUEST", payload=msg_payload)
-            db.session.add(notif)
-            db.session.commit()
-
-            sms_ok = False
-            if d.phone:
-                try:
-                    sms_ok = send_sms_twilio(d.phone, msg_payload)
-                except:
-                    sms_ok = False
-
-            try:
-                socketio.emit("request_notification", {"request_id": br.id, "patient_name": br.patient_name, "blood_group": br.required_blood_group, "latitude": br.latitude, "longitude": br.longitude, "message": msg_payload}, room=f"donor_{d.id}")
-            except:
-                pass
-
-            notified.append({"donor_id": d.id, "name": d.name, "phone": d.phone, "distance_km": round(dist,2), "score": round(score,3), "sms_sent": sms_ok})
-
+        req_info = {"patient_name": patient, "required_blood_group": blood, "latitude": latf, "longitude": lonf, "status": "OPEN"}
+        # INSERT ... RETURNING id: the fan-out below only needs the new id, not an ORM instance
+        req_info["id"] = db.session.execute(
+            insert(BloodRequest).returning(BloodRequest.id),
+            dict(req_info, created_by=session.get("user_id")),
+        ).scalar_one()
+
+        ranked = find_best_donors(blood, latf, lonf, max_results=top_k)
+
+        # the request was just created, so none of these donors has a notification for it yet:
+        # insert them all in one executemany round-trip instead of add+commit per donor
+        msg_payload = f"URGENT: Blood needed ({blood}) for {patient} near your area."
+        rows = [{"donor_id": d.id, "request_id": req_info["id"], "notif_type": "REQUEST", "payload": msg_payload} for d, _, _ in ranked]
+        if rows:
+            db.session.execute(Notification.__table__.insert(), rows)
+
+        # snapshot what the fan-out needs: commit() expires every ranked donor
         safe_matches = []
         for d, dist, score in ranked:
             safe_matches.append({
@@ -433,26 +656,59 @@ def request_blood():
                 "score": round(score, 3),
                 "is_online": bool(d.is_online)
             })
+        db.session.commit()
+        invalidate_open_requests()
+        invalidate_admin_counts()
+        invalidate_notifications()
+
+        sms_phones = [m["phone"] for m in safe_matches if m["phone"]]
+        if sms_phones:
+            send_sms_batch(sms_phones, msg_payload)
+
+        # one emit to every matched donor's room: the packet is encoded once for the whole fan-out
+        if safe_matches:
+            try:
+                socketio.emit("request_notification", {"request_id": req_info["id"], "patient_name": req_info["patient_name"], "blood_group": req_info["required_blood_group"], "latitude": req_info["latitude"], "longitude": req_info["longitude"], "message": msg_payload}, room=[f"donor_{m['id']}" for m in safe_matches])
+            except:
+                pass
+
+        # without Twilio send_sms_twilio only logs a mock, so nothing is actually queued
+        sms_enabled = twilio_configured()
+        notified = []
+        for m in safe_matches:
+            notified.append({"donor_id": m["id"], "name": m["name"], "phone": m["phone"], "distance_km": m["distance_km"], "score": m["score"], "sms_queued": bool(m["phone"]) and sms_enabled})
 
         try:
-            socketio.emit("request_created", {"id": br.id, "patient_name": br.patient_name, "required_blood_group": br.required_blood_group, "latitude": br.latitude, "longitude": br.longitude, "status": br.status}, room="hospitals")
+            socketio.emit("request_created", req_info, room="hospitals")
         except:
             pass
 
-        return render_template("results.html", notified=notified, matches=safe_matches, request_id=br.id)
+        return render_template("results.html", notified=notified, matches=safe_matches, request_id=req_info["id"])
 
     return render_template("request_blood.html", error=None, matches=[], rejected=[], form={})
 
 @app.route("/hospital/requests")
 @login_required(role="hospital")
 def hospital_requests():
-    rows = BloodRequest.query.order_by(BloodRequest.created_at.desc()).all()
+    # keyset pagination on (created_at, id): each page costs the same however long the history gets
+    # many-to-one, so the LEFT JOIN adds no rows and the page stays a single query
+    query = BloodRequest.query.options(joinedload(BloodRequest.accepted_donor))
+    before_id = request.args.get("before_id", type=int)
+    try:
+        before = datetime.fromisoformat(request.args.get("before", ""))
+    except ValueError:
+        before = None
+    if before and before_id:
+        query = query.filter(db.tuple_(BloodRequest.created_at, BloodRequest.id) < (before, before_id))
+    rows = query.order_by(BloodRequest.created_at.desc(), BloodRequest.id.desc()).limit(REQUESTS_PAGE_SIZE + 1).all()
+    next_cursor = None
+    if len(rows) > REQUESTS_PAGE_SIZE:
+        rows = rows[:REQUESTS_PAGE_SIZE]
+        next_cursor = {"before": rows[-1].created_at.isoformat(), "before_id": rows[-1].id}
     out = []
     for r in rows:
-        accepted = None
-        if r.accepted_donor_id:
-            d = Donor.query.get(r.accepted_donor_id)
-            accepted = {"id": d.id, "name": d.name, "phone": d.phone} if d else None
+        d = r.accepted_donor
+        accepted = {"id": d.id, "name": d.name, "phone": d.phone} if d else None
         out.append({
             "id": r.id,
             "patient_name": r.patient_name,
@@ -463,7 +719,7 @@ def hospital_requests():
             "status": r.status,
             "accepted": accepted
         })
-    return render_template("hospital_requests.html", requests=out)
+    return stream_page("hospital_requests.html", requests=out, next_cursor=next_cursor)
 
 @app.route("/cancel_request/<int:request_id>", methods=["POST"])
 @login_required(role="hospital")
@@ -471,6 +727,8 @@ def cancel_request(request_id):
     br = BloodRequest.query.get_or_404(request_id)
     br.status = "CANCELLED"
     db.session.commit()
+    invalidate_open_requests()
+    invalidate_admin_counts()
     socketio.emit("request_cancelled", {"id": br.id}, room="hospitals")
     flash("Request cancelled.", "info")
     return redirect(url_for("hospital_requests"))
@@ -486,6 +744,8 @@ def accept_request(request_id):
     br.status = "ACCEPTED"
     br.assigned_at = datetime.utcnow()
     db.session.commit()
+    invalidate_open_requests()
+    invalidate_admin_counts()
     socketio.emit("request_accepted", {"request_id": br.id, "donor_id": br.accepted_donor_id}, room="hospitals")
     flash("Request accepted. Hospital will be notified and you will be tracked.", "info")
     return redirect(url_for("donor_dashboard"))
@@ -501,30 +761,27 @@ def cancel_assignment(request_id, donor_id):
     br.accepted_donor_id = None
     br.status = "OPEN"
     br.assigned_at = None
+
+    top_k = 10
+    ranked = find_best_donors(br.required_blood_group, br.latitude, br.longitude, max_results=top_k)
+    payload = f"URGENT: Blood needed ({br.required_blood_group}) for {br.patient_name} — reopened."
+    notified = insert_missing_notifications(br.id, [d.id for d, _, _ in ranked if d.id != donor_id], "REQUEST", payload)
+    # one transaction for the reopen and its notifications; snapshot br before commit expires it
+    notify_event = {"request_id": br.id, "patient_name": br.patient_name, "blood_group": br.required_blood_group, "latitude": br.latitude, "longitude": br.longitude, "message": payload}
     db.session.commit()
+    invalidate_open_requests()
+    invalidate_admin_counts()
+    invalidate_notifications()
+
     try:
-        socketio.emit("assignment_cancelled", {"request_id": br.id, "message": "Hospital cancelled your assignment."}, room=f"donor_{donor_id}")
+        socketio.emit("assignment_cancelled", {"request_id": notify_event["request_id"], "message": "Hospital cancelled your assignment."}, room=f"donor_{donor_id}")
     except:
         pass
-
-    top_k = 10
-    ranked = find_best_donors(br.required_blood_group, br.latitude, br.longitude, max_results=top_k)
-    notified = []
-    for d, dist, score in ranked:
-        if d.id == donor_id:
-            continue
-        existing = Notification.query.filter_by(donor_id=d.id, request_id=br.id).first()
-        if existing:
-            continue
-        payload = f"URGENT: Blood needed ({br.required_blood_group}) for {br.patient_name} — reopened."
-        notif = Notification(donor_id=d.id, request_id=br.id, notif_type="REQUEST", payload=payload)
-        db.session.add(notif)
-        db.session.commit()
+    if notified:
         try:
-            socketio.emit("request_notification", {"request_id": br.id, "patient_name": br.patient_name, "blood_group": br.required_blood_group, "latitude": br.latitude, "longitude": br.longitude, "message": payload}, room=f"donor_{d.id}")
+            socketio.emit("request_notification", notify_event, room=[f"donor_{i}" for i in notified])
         except:
             pass
-        notified.append({"donor_id": d.id, "name": d.name})
     flash(f"Re-notified {len(notified)} donors.", "info")
     return redirect(url_for("hospital_requests"))
 
@@ -541,6 +798,8 @@ def hospital_mark_reached(request_id):
 
     br.status = "DONOR_REACHED"
     db.session.commit()
+    invalidate_open_requests()
+    invalidate_admin_counts()
 
     # Notify donor room and hospitals/admins that status changed
     try:
@@ -566,6 +825,8 @@ def hospital_mark_completed(request_id):
 
     br.status = "FULFILLED"
     db.session.commit()
+    invalidate_open_requests()
+    invalidate_admin_counts()
 
     try:
         socketio.emit("request_updated", {"id": br.id, "status": br.status, "accepted_donor_id": br.accepted_donor_id}, room="hospitals")
@@ -585,30 +846,49 @@ def hospital_reassign(request_id):
         return redirect(url_for("hospital_requests"))
     top_k = int(request.form.get("top_k", 10))
     ranked = find_best_donors(br.required_blood_group, br.latitude, br.longitude, max_results=top_k)
-    notified = []
-    for d, dist, score in ranked:
-        existing = Notification.query.filter_by(donor_id=d.id, request_id=br.id).first()
-        if existing:
-            continue
-        payload = f"URGENT: Blood needed ({br.required_blood_group}) for {br.patient_name} — hospital manual reassign."
-        notif = Notification(donor_id=d.id, request_id=br.id, notif_type="REQUEST", payload=payload)
-        db.session.add(notif)
-        db.session.commit()
+    payload = f"URGENT: Blood needed ({br.required_blood_group}) for {br.patient_name} — hospital manual reassign."
+    notified = insert_missing_notifications(br.id, [d.id for d, _, _ in ranked], "REQUEST", payload)
+    notify_event = {"request_id": br.id, "patient_name": br.patient_name, "blood_group": br.required_blood_group, "latitude": br.latitude, "longitude": br.longitude, "message": payload}
+    db.session.commit()
+    invalidate_notifications()
+
+    if notified:
         try:
-            socketio.emit("request_notification", {"request_id": br.id, "patient_name": br.patient_name, "blood_group": br.required_blood_group, "latitude": br.latitude, "longitude": br.longitude, "message": payload}, room=f"donor_{d.id}")
+            socketio.emit("request_notification", notify_event, room=[f"donor_{i}" for i in notified])
         except:
             pass
-        notified.append({"donor_id": d.id, "name": d.name})
     flash(f"Notified {len(notified)} donors.", "info")
     return redirect(url_for("hospital_requests"))
 
+# all four counters in one round-trip (CASE instead of FILTER so SQLite works too);
+# no parameters, so the statement is built once at import rather than per page view
+ADMIN_COUNTS = select(
+    select(func.count(Donor.id)).scalar_subquery(),
+    select(func.count(Donor.id)).where(Donor.is_online.is_(True)).scalar_subquery(),
+    func.count(BloodRequest.id),
+    func.count(case((BloodRequest.status == "OPEN", 1))),
+).select_from(BloodRequest)
+
+# the counters are "good enough" stats: serve them from memory for a while
+ADMIN_COUNTS_TTL = 30  # seconds; donor/request creation, deletion and status changes clear it sooner
+
+_admin_counts = {"expires": 0.0, "value": None}
+
+def admin_counts():
+    now = time.monotonic()
+    if _admin_counts["value"] is None or now >= _admin_counts["expires"]:
+        _admin_counts["value"] = tuple(db.session.execute(ADMIN_COUNTS).one())
+        _admin_counts["expires"] = now + ADMIN_COUNTS_TTL
+    return _admin_counts["value"]
+
+def invalidate_admin_counts():
+    _admin_counts["value"] = None
+
 @app.route("/admin/dashboard")
 @login_required(role="admin")
 def admin_dashboard():
-    total_donors = Donor.query.count()
-    total_requests = BloodRequest.query.count()
-    open_requests = BloodRequest.query.filter_by(status="OPEN").count()
-    active_donors = Donor.query.filter_by(is_online=True).count()
+    # the online count can lag by up to ADMIN_COUNTS_TTL; presence changes don't invalidate it
+    total_donors, active_donors, total_requests, open_requests = admin_counts()
     recent_requests = BloodRequest.query.order_by(BloodRequest.created_at.desc()).limit(8).all()
     return render_template("admin_dashboard.html", total_donors=total_donors, total_requests=total_requests, open_requests=open_requests, active_donors=active_donors, recent_requests=recent_requests)
 
@@ -627,9 +907,17 @@ def donors_list():
         like = f"%{q}%"
         query = query.filter(db.or_(Donor.name.ilike(like), Donor.phone.ilike(like)))
     if bg:
-        query = query.filter_by(blood_group=bg)
-    donors = query.order_by(Donor.id.desc()).all()
-    return render_template("donors.html", donors=donors)
+        query = query.filter_by(blood_group=canonical_blood(bg))
+    # keyset on id, newest first: one page in memory instead of the whole donor table
+    before_id = request.args.get("before_id", type=int)
+    if before_id:
+        query = query.filter(Donor.id < before_id)
+    donors = query.order_by(Donor.id.desc()).limit(DONORS_PAGE_SIZE + 1).all()
+    next_cursor = None
+    if len(donors) > DONORS_PAGE_SIZE:
+        donors = donors[:DONORS_PAGE_SIZE]
+        next_cursor = {"q": q, "blood_group": bg, "before_id": donors[-1].id}
+    return stream_page("donors.html", donors=donors, next_cursor=next_cursor)
 
 @app.route("/edit_donor/<int:donor_id>", methods=["GET", "POST"])
 @login_required(role="admin")
@@ -637,7 +925,7 @@ def edit_donor(donor_id):
     d = Donor.query.get_or_404(donor_id)
     if request.method == "POST":
         d.name = request.form.get("name", d.name)
-        d.blood_group = request.form.get("blood_group", d.blood_group)
+        d.blood_group = canonical_blood(request.form.get("blood_group")) or d.blood_group
         d.phone = request.form.get("phone", d.phone)
         d.is_available = request.form.get("is_available") == "yes"
         try:
@@ -646,6 +934,7 @@ def edit_donor(donor_id):
         except:
             pass
         db.session.commit()
+        invalidate_donor_cache()
         flash("Donor updated", "info")
         return redirect(url_for("donors_list"))
     return render_template("edit_donor.html", donor=d)
@@ -653,12 +942,16 @@ def edit_donor(donor_id):
 @app.route("/delete_donor/<int:donor_id>", methods=["POST"])
 @login_required(role="admin")
 def delete_donor(donor_id):
-    d = Donor.query.get(donor_id)
-    if not d:
+    # one DELETE statement: no SELECT first, no Donor instance to load just to remove it
+    res = db.session.execute(delete(Donor).where(Donor.id == donor_id))
+    db.session.commit()
+    # a queued donor_share position must not be flushed for a donor that no longer exists
+    pop_pending_position(donor_id)
+    if res.rowcount == 0:
         flash("Not found", "error")
         return redirect(url_for("donors_list"))
-    db.session.delete(d)
-    db.session.commit()
+    invalidate_donor_cache()
+    invalidate_admin_counts()
     flash("Donor deleted", "info")
     return redirect(url_for("donors_list"))
 
@@ -666,12 +959,18 @@ def delete_donor(donor_id):
 @app.route("/api/all_donors")
 @login_required(role="admin")
 def api_all_donors():
-    donors = Donor.query.all()
-    out = []
-    for d in donors:
-        out.append({"id": d.id, "name": d.name, "phone": d.phone, "blood_group": d.blood_group, "latitude": d.latitude, "longitude": d.longitude, "is_online": d.is_online, "last_seen": d.last_seen.isoformat() if d.last_seen else None})
+    # column projection: plain rows, no Donor instances or identity-map bookkeeping
+    rows = db.session.execute(select(
+        Donor.id, Donor.name, Donor.phone, Donor.blood_group, Donor.latitude, Donor.longitude, Donor.is_online, Donor.last_seen
+    )).all()
+    out = [{"id": d.id, "name": d.name, "phone": d.phone, "blood_group": d.blood_group, "latitude": d.latitude, "longitude": d.longitude, "is_online": d.is_online, "last_seen": d.last_seen.isoformat() if d.last_seen else None} for d in rows]
+    if orjson is not None:
+        return app.response_class(orjson.dumps(out), mimetype="application/json")
     return jsonify(out)
 
+# only hospital request pages and admin maps consume donor location events
+DONOR_WATCH_ROOMS = ["hospitals", "admins"]
+
 @socketio.on("join")
 def on_join(data):
     if data.get("room"):
@@ -694,35 +993,44 @@ def handle_donor_share(data):
     d = Donor.query.get(donor_id)
     if not d:
         return
-    d.latitude = lat
-    d.longitude = lon
-    d.is_online = True
-    d.last_seen = datetime.utcnow()
-    db.session.commit()
+    ensure_background_jobs()
+    seen_at = datetime.utcnow()
+    # the location itself is written by flush_positions_loop; only notifications commit here
+    queue_position(donor_id, lat, lon, seen_at)
+    payload = {"id": d.id, "name": d.name, "blood_group": d.blood_group, "latitude": lat, "longitude": lon, "is_online": True, "last_seen": seen_at.isoformat()}
+
+    in_range = []
+    donor_can = canonical_blood(d.blood_group)
+    if donor_can in CAN_DONATE_TO:
+        # vectorised haversine over the cached OPEN requests this donor is compatible with
+        in_range = open_requests_within(lat, lon, 10, CAN_DONATE_TO[donor_can])
+
+    nearby = []
+    if in_range:
+        # one IN query instead of an existence check per nearby request
+        already = {row[0] for row in db.session.query(Notification.request_id).filter(
+            Notification.donor_id == donor_id, Notification.request_id.in_([br.id for br, _ in in_range]))}
+        for br, dist in in_range:
+            if br.id in already:
+                continue
+            message = f"Nearby request {br.id} ({br.required_blood_group}) for {br.patient_name}, {round(dist,2)}km"
+            nearby.append({"request_id": br.id, "patient_name": br.patient_name, "blood_group": br.required_blood_group, "distance_km": round(dist,2), "message": message})
+        if nearby:
+            db.session.execute(Notification.__table__.insert(), [
+                {"donor_id": donor_id, "request_id": n["request_id"], "notif_type": "NEARBY", "payload": n["message"]} for n in nearby])
+            db.session.commit()
+            invalidate_notifications()
 
-    open_requests = BloodRequest.query.filter_by(status="OPEN").all()
-    for br in open_requests:
-        donor_can = canonical_blood(d.blood_group)
-        if donor_can is None:
-            continue
+    update_cached_donor(donor_id, latitude=lat, longitude=lon, is_online=True)
+
+    for nearby_event in nearby:
         try:
-            dist = haversine_distance(br.latitude, br.longitude, d.latitude, d.longitude)
-        except Exception:
-            dist = float('inf')
-        if dist <= 10:
-            existing = Notification.query.filter_by(donor_id=d.id, request_id=br.id).first()
-            if not existing:
-                payload = f"Nearby request {br.id} ({br.required_blood_group}) for {br.patient_name}, {round(dist,2)}km"
-                notif = Notification(donor_id=d.id, request_id=br.id, notif_type="NEARBY", payload=payload)
-                db.session.add(notif)
-                db.session.commit()
-                try:
-                    socketio.emit("nearby_request", {"request_id": br.id, "patient_name": br.patient_name, "blood_group": br.required_blood_group, "distance_km": round(dist,2), "message": payload}, room=f"donor_{d.id}")
-                except:
-                    pass
+            socketio.emit("nearby_request", nearby_event, room=f"donor_{payload['id']}")
+        except:
+            pass
 
-    payload = {"id": d.id, "name": d.name, "blood_group": d.blood_group, "latitude": d.latitude, "longitude": d.longitude, "is_online": d.is_online, "last_seen": d.last_seen.isoformat() if d.last_seen else None}
-    emit("donor_updated", payload, broadcast=True)
+    # one emit for both rooms: encoded once, and a socket in both rooms gets it once
+    emit("donor_updated", payload, room=DONOR_WATCH_ROOMS)
 
 @socketio.on("donor_offline")
 def handle_donor_offline(data):
@@ -732,10 +1040,15 @@ def handle_donor_offline(data):
         return
     d = Donor.query.get(donor_id)
     if d:
+        # take over any unflushed position so a later flush can't flip the donor back online
+        pending = pop_pending_position(donor_id)
+        if pending:
+            d.latitude, d.longitude = pending[0], pending[1]
         d.is_online = False
         d.last_seen = datetime.utcnow()
         db.session.commit()
-        emit("donor_offline", {"id": d.id}, broadcast=True)
+        update_cached_donor(donor_id, is_online=False)
+        emit("donor_offline", {"id": d.id}, room=DONOR_WATCH_ROOMS)
 
 @socketio.on("leave")
 def on_leave(data):
@@ -744,13 +1057,107 @@ def on_leave(data):
         leave_room(room)
         emit("left", {"room": room}, room=request.sid)
 
+# donor.age is written at registration; this keeps it current as birthdays pass
+AGE_REFRESH_INTERVAL = 24 * 60 * 60
+
+def refresh_donor_ages(today=None):
+    today = today or date.today()
+    rows = db.session.execute(select(Donor.id, Donor.dob, Donor.age).where(Donor.dob.isnot(None))).all()
+    changed = []
+    for r in rows:
+        age = compute_age_from_dob(r.dob, today)
+        if age != r.age:
+            changed.append({"id": r.id, "age": age})
+    if changed:
+        # Core executemany, not ORM bulk-by-PK: a donor deleted meanwhile is skipped instead of
+        # raising StaleDataError and rolling back everyone else's update
+        donor = Donor.__table__
+        db.session.execute(donor.update().where(donor.c.id == bindparam("b_id")).values(age=bindparam("b_age")),
+                           [{"b_id": c["id"], "b_age": c["age"]} for c in changed])
+        db.session.commit()
+        invalidate_donor_cache()
+    return len(changed)
+
+def age_refresh_loop():
+    while True:
+        with app.app_context():
+            try:
+                n = refresh_donor_ages()
+                if n:
+                    print("[AGES] refreshed donor ages:", n)
+            except Exception as e:
+                db.session.rollback()
+                print("[AGES] refresh failed:", e)
+        socketio.sleep(AGE_REFRESH_INTERVAL)
+
+# donor_share pings land here and are written in one bulk UPDATE every few seconds
+POSITION_FLUSH_INTERVAL = 2
+
+_pending_positions = {}  # donor_id -> (lat, lon, seen_at)
+_pending_lock = threading.Lock()
+
+def queue_position(donor_id, lat, lon, seen_at):
+    with _pending_lock:
+        _pending_positions[donor_id] = (lat, lon, seen_at)
+
+def peek_pending_position(donor_id):
+    with _pending_lock:
+        return _pending_positions.get(donor_id)
+
+def pop_pending_position(donor_id):
+    with _pending_lock:
+        return _pending_positions.pop(donor_id, None)
+
+def flush_positions():
+    global _pending_positions
+    with _pending_lock:
+        batch, _pending_positions = _pending_positions, {}
+    if not batch:
+        return 0
+    # Core executemany (see refresh_donor_ages): rows deleted since the ping just match nothing
+    donor = Donor.__table__
+    db.session.execute(
+        donor.update().where(donor.c.id == bindparam("b_id")).values(
+            latitude=bindparam("b_lat"), longitude=bindparam("b_lon"), is_online=True, last_seen=bindparam("b_seen")),
+        [{"b_id": donor_id, "b_lat": lat, "b_lon": lon, "b_seen": seen_at}
+         for donor_id, (lat, lon, seen_at) in batch.items()])
+    db.session.commit()
+    for donor_id, (lat, lon, _) in batch.items():
+        # donors that just got a first location are now matchable
+        update_cached_donor(donor_id, latitude=lat, longitude=lon, is_online=True)
+    return len(batch)
+
+def flush_positions_loop():
+    while True:
+        socketio.sleep(POSITION_FLUSH_INTERVAL)
+        with app.app_context():
+            try:
+                flush_positions()
+            except Exception as e:
+                db.session.rollback()
+                print("[POSITIONS] flush failed:", e)
+
+_background_lock = threading.Lock()
+_background_started = False
+
+@app.before_request
+def ensure_background_jobs():
+    # started lazily so they run under gunicorn too, once per worker process
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if not _background_started:
+            _background_started = True
+            socketio.start_background_task(age_refresh_loop)
+            socketio.start_background_task(flush_positions_loop)
+
 def ensure_admin():
     admin_user = os.getenv('ADMIN_USER', 'admin')
     admin_pass = os.getenv('ADMIN_PASS', 'admin123')
     u = User.query.filter_by(username=admin_user).first()
     if not u:
-        from werkzeug.security import generate_password_hash
-        u = User(username=admin_user, role='admin', password_hash=generate_password_hash(admin_pass))
+        u = User(username=admin_user, role='admin', password_hash=hash_password(admin_pass))
         db.session.add(u)
         db.session.commit()
         print("[INIT] Created admin user:", admin_user)
@@ -762,10 +1169,10 @@ def init_db(reset: bool = False):
 
         insp = inspect(db.engine)
 
-        # ---- Donor table migrations (add missing columns if necessary) ----
-        if insp.has_table("donor"):
-            cols = [c["name"] for c in insp.get_columns("donor")]
-            required = {
+        # ---- column migrations: collect every missing column first, then add them in one transaction ----
+        required = {
+            # Donor table
+            "donor": {
                 "dob": "DATE",
                 "age": "INTEGER",
                 "weight_kg": "FLOAT",
@@ -774,31 +1181,63 @@ def init_db(reset: bool = False):
                 "consent": "BOOLEAN",
                 "photo": "TEXT",
                 "residential_area": "TEXT"
-            }
-            for col, coltype in required.items():
-                if col not in cols:
-                    try:
-                        db.session.execute(text(f'ALTER TABLE donor ADD COLUMN "{col}" {coltype}'))
-                        print("[MIGRATE] Added donor column:", col)
-                    except Exception as e:
-                        print("[MIGRATE] donor column skip:", col, e)
-
-        # ---- BloodRequest table migrations ----
-        if insp.has_table("blood_request"):
-            cols = [c["name"] for c in insp.get_columns("blood_request")]
-            required = {
+            },
+            # BloodRequest table
+            "blood_request": {
                 "accepted_donor_id": "INTEGER",
                 "assigned_at": "TIMESTAMP"
-            }
-            for col, coltype in required.items():
-                if col not in cols:
-                    try:
-                        db.session.execute(text(f'ALTER TABLE blood_request ADD COLUMN "{col}" {coltype}'))
-                        print("[MIGRATE] Added request column:", col)
-                    except Exception as e:
-                        print("[MIGRATE] request column skip:", col, e)
+            },
+        }
+        missing = []
+        for table, columns in required.items():
+            if insp.has_table(table):
+                cols = {c["name"] for c in insp.get_columns(table)}
+                missing += [(table, col, coltype) for col, coltype in columns.items() if col not in cols]
+        if missing:
+            try:
+                with db.engine.begin() as conn:
+                    for table, col, coltype in missing:
+                        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN "{col}" {coltype}'))
+                for table, col, _ in missing:
+                    print(f"[MIGRATE] Added {table} column:", col)
+            except Exception as e:
+                print("[MIGRATE] column migration skipped:", e)
+
+        # ---- indexes declared on the models (create_all skips them on existing tables) ----
+        for table in db.metadata.sorted_tables:
+            for ix in table.indexes:
+                try:
+                    ix.create(db.engine, checkfirst=True)
+                except Exception as e:
+                    print("[MIGRATE] index skip:", ix.name, e)
 
-        db.session.commit()
+        # ---- data migration: blood groups stored in canonical form (register/edit write it that way now) ----
+        try:
+            # one UPDATE per distinct legacy spelling, not one per donor
+            fixes = [{"raw": bg, "canon": canonical_blood(bg)}
+                     for bg in db.session.scalars(select(Donor.blood_group).distinct())
+                     if bg and canonical_blood(bg) != bg]
+            if fixes:
+                db.session.execute(
+                    Donor.__table__.update().where(Donor.blood_group == bindparam("raw")).values(blood_group=bindparam("canon")),
+                    fixes)
+                db.session.commit()
+                print("[MIGRATE] Canonicalised blood groups:", ", ".join(f["raw"] for f in fixes))
+        except Exception as e:
+            db.session.rollback()
+            print("[MIGRATE] blood group migration skipped:", e)
+
+        # ---- Postgres: indexed radius search for find_best_donors ----
+        if db.engine.dialect.name == "postgresql":
+            try:
+                db.session.execute(text("CREATE EXTENSION IF NOT EXISTS cube"))
+                db.session.execute(text("CREATE EXTENSION IF NOT EXISTS earthdistance"))
+                db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_donor_ll_to_earth ON donor USING gist (ll_to_earth(latitude, longitude))"))
+                db.session.commit()
+                print("[MIGRATE] earthdistance index ready")
+            except Exception as e:
+                db.session.rollback()
+                print("[MIGRATE] earthdistance skip:", e)
 
         # ensure admin user exists
         try:
@@ -808,11 +1247,14 @@ def init_db(reset: bool = False):
 
         print("[INIT] Database ready.")
 
+# `flask --app app init-db`: same bootstrap for gunicorn deploys, where __main__ never runs
+@app.cli.command("init-db")
+def init_db_command():
+    init_db()
+
 # -----------------------------------------------
 # ONE-TIME INITIALIZATION ROUTE FOR RENDER ONLY
 # -----------------------------------------------
-from werkzeug.security import generate_password_hash
-
 @app.route("/init_db_magic_secret", methods=["GET"])
 def init_db_magic():
     secret = request.args.get("s")
@@ -820,22 +1262,8 @@ def init_db_magic():
         return "Access Denied", 403
     
     try:
-        with app.app_context():
-            db.create_all()
-
-            # ensure admin user exists
-            admin_user = os.getenv("ADMIN_USER", "admin")
-            admin_pass = os.getenv("ADMIN_PASS", "admin123")
-
-            if not User.query.filter_by(username=admin_user).first():
-                u = User(
-                    username=admin_user,
-                    role="admin",
-                    password_hash=generate_password_hash(admin_pass)
-                )
-                db.session.add(u)
-                db.session.commit()
-
+        # same bootstrap as `python app.py`: tables, column migrations, indexes, admin user
+        init_db()
         return "DB CREATED SUCCESSFULLY, ADMIN READY", 200
 
     except Exception as e:
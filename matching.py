@@ -1,8 +1,11 @@
 # matching.py
 import math
-from datetime import datetime
-from models import Donor
-import re
+import time
+from datetime import datetime, date, timedelta
+import numpy as np
+from sqlalchemy import select, text, or_
+from sqlalchemy.orm import load_only
+from models import db, Donor, BloodRequest
 
 COMPATIBILITY = {
     "O-": ["O-"],
@@ -15,12 +18,48 @@ COMPATIBILITY = {
     "AB+": ["O-", "O+", "A-", "A+", "B-", "B+", "AB-", "AB+"],
 }
 
+# inverse of COMPATIBILITY: donor group -> recipient groups it can give to
+CAN_DONATE_TO = {g: [r for r, donors in COMPATIBILITY.items() if g in donors] for g in COMPATIBILITY}
+
+# blood groups as small ints: a group filter becomes one lookup-table index per row
+# instead of np.isin over an object array of strings
+BLOOD_GROUPS = tuple(COMPATIBILITY)
+_GROUP_CODE = {g: i for i, g in enumerate(BLOOD_GROUPS)}
+
+def group_codes(groups):
+    # unknown/None -> -1, which indexes the always-False last slot of group_lookup
+    return np.fromiter((_GROUP_CODE.get(g, -1) for g in groups), dtype=np.int8, count=len(groups))
+
+def group_lookup(allowed):
+    table = np.zeros(len(BLOOD_GROUPS) + 1, dtype=bool)
+    table[[_GROUP_CODE[g] for g in allowed if g in _GROUP_CODE]] = True
+    return table
+
+# applied in order; same rewrites the chained .replace() calls did
+_BG_TOKENS = (('POS', '+'), ('NEG', '-'), ('+VE', '+'), ('-VE', '-'), ('OPOS', 'O+'), ('ONEG', 'O-'))
+
+def _normalize_blood(bg):
+    # split/join drops all whitespace in one pass (what re.sub(r'\s+', '') did)
+    s = "".join(str(bg).upper().split())
+    for token, repl in _BG_TOKENS:
+        if token in s:
+            s = s.replace(token, repl)
+    return s
+
+# raw spelling -> canonical group; the column only ever holds a handful of distinct spellings,
+# so after warm-up every call is one dict probe instead of the string rewrites above
+_BG_CANON = {g: g for g in COMPATIBILITY}
+_BG_CANON_MAX = 1024
+
 def canonical_blood(bg):
     if not bg: return None
-    s = str(bg).upper().strip()
-    s = re.sub(r'\s+', '', s)
-    s = s.replace('POS', '+').replace('NEG', '-').replace('+VE', '+').replace('-VE', '-')
-    s = s.replace('OPOS', 'O+').replace('ONEG', 'O-')
+    try:
+        return _BG_CANON[bg]
+    except (KeyError, TypeError):
+        pass
+    s = _normalize_blood(bg)
+    if len(_BG_CANON) < _BG_CANON_MAX:
+        _BG_CANON[bg] = s
     return s
 
 def haversine_distance(lat1, lon1, lat2, lon2):
@@ -35,7 +74,61 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     except Exception:
         return float('inf')
 
-def is_eligible(donor, min_days=90, min_weight=50.0, min_age=18, max_age=65):
+def _haversine_terms(lat1, lon1, lats, lons):
+    # a = sin²(d / 2R) for one point against arrays of coordinates (degrees)
+    lat1_r = math.radians(lat1)
+    lats_r = np.radians(lats)
+    d_lat = lats_r - lat1_r
+    d_lon = np.radians(lons) - math.radians(lon1)
+    return np.sin(d_lat / 2) ** 2 + math.cos(lat1_r) * np.cos(lats_r) * np.sin(d_lon / 2) ** 2
+
+def haversine_distances(lat1, lon1, lats, lons):
+    # vectorised haversine_distance: one request point against arrays of donor coordinates (degrees)
+    R = 6371.0
+    a = _haversine_terms(lat1, lon1, lats, lons)
+    return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def haversine_within(lat1, lon1, lats, lons, max_distance_km):
+    # -> (indices within max_distance_km, their distances). a grows monotonically with distance,
+    # so the radius gate compares a directly and only the survivors pay for sqrt/arctan2;
+    # the gate is slightly widened and the exact distance makes the final cut
+    R = 6371.0
+    a = _haversine_terms(lat1, lon1, lats, lons)
+    a_max = math.sin(min(max_distance_km / (2 * R), math.pi / 2)) ** 2
+    idx = np.flatnonzero(a <= a_max * (1 + 1e-9) + 1e-15)
+    a = a[idx]
+    dist = 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    inside = dist <= max_distance_km
+    return idx[inside], dist[inside]
+
+EARTH_RADIUS_KM = 6371.0
+
+def bounding_box_mask(lat, lon, max_distance_km, lats, lons):
+    # exact lat/lon box of the radius: anything outside is certainly farther than max_distance_km
+    delta = max_distance_km / EARTH_RADIUS_KM
+    mask = np.abs(lats - lat) <= math.degrees(delta)
+    ratio = math.sin(delta) / max(math.cos(math.radians(lat)), 1e-12)
+    if ratio < 1 and delta < math.pi / 2:
+        # circle doesn't reach a pole: longitude spread is bounded too (wrapped across the antimeridian)
+        dlon = np.abs((lons - lon + 180.0) % 360.0 - 180.0)
+        mask &= dlon <= math.degrees(math.asin(ratio))
+    return mask
+
+def unit_vectors(lats, lons):
+    # (lat, lon) in degrees -> points on the unit sphere, shape (N, 3)
+    lat_r = np.radians(lats)
+    lon_r = np.radians(lons)
+    cos_lat = np.cos(lat_r)
+    return np.column_stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)))
+
+def compute_age_from_dob(dob, today=None):
+    # batch callers pass today once instead of re-reading the clock per donor
+    if not dob:
+        return None
+    today = today or date.today()
+    return today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+
+def is_eligible(donor, min_days=90, min_weight=50.0, min_age=18, max_age=65, today=None, utc_today=None):
     if not donor.is_available:
         return False
     if donor.weight_kg is None or donor.weight_kg < min_weight:
@@ -43,44 +136,254 @@ def is_eligible(donor, min_days=90, min_weight=50.0, min_age=18, max_age=65):
     donor_age = donor.age
     if donor_age is None and donor.dob:
         try:
-            from datetime import date
-            today = date.today()
-            donor_age = today.year - donor.dob.year - ((today.month, today.day) < (donor.dob.month, donor.dob.day))
+            donor_age = compute_age_from_dob(donor.dob, today)
         except Exception:
             donor_age = None
     if donor_age is None or donor_age < min_age or donor_age > max_age:
         return False
     if donor.last_donation_date:
-        days = (datetime.utcnow().date() - donor.last_donation_date).days
+        days = ((utc_today or datetime.utcnow().date()) - donor.last_donation_date).days
         if days < min_days:
             return False
     return True
 
+def eligibility_filter(min_days=90, min_weight=50.0):
+    # the column-only half of is_eligible as SQL, so ineligible rows never leave the database;
+    # is_eligible still runs on what comes back for the age/dob rules
+    cutoff = datetime.utcnow().date() - timedelta(days=min_days)
+    return (
+        Donor.is_available.is_(True),
+        Donor.weight_kg >= min_weight,
+        or_(Donor.last_donation_date.is_(None), Donor.last_donation_date <= cutoff),
+    )
+
+# what matching and request_blood read off a Donor; photo, chronic_conditions, password_hash, ... stay unloaded
+MATCH_LOAD = load_only(
+    Donor.id, Donor.name, Donor.phone, Donor.blood_group, Donor.latitude, Donor.longitude, Donor.is_online,
+    Donor.is_available, Donor.weight_kg, Donor.age, Donor.dob, Donor.last_donation_date,
+)
+
+_earthdistance = None
+
+def has_earthdistance():
+    # probed once per process; only Postgres with the cube/earthdistance extensions qualifies
+    global _earthdistance
+    if _earthdistance is None:
+        if db.engine.dialect.name != "postgresql":
+            _earthdistance = False
+        else:
+            try:
+                row = db.session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'earthdistance'")).first()
+                _earthdistance = row is not None
+            except Exception:
+                # clear the aborted transaction for the rest of this request; leave the flag
+                # unset so the next call probes again instead of caching a transient failure
+                db.session.rollback()
+                return False
+    return _earthdistance
+
+_EARTH_BOX = text("earth_box(ll_to_earth(:req_lat, :req_lon), :radius_m) @> ll_to_earth(donor.latitude, donor.longitude)")
+
+def candidate_donors(req_lat, req_lon, max_distance_km):
+    # earth_box is a GiST-indexable superset of the radius; haversine does the exact cut.
+    # Core rows of SNAPSHOT_COLUMNS, not Donor instances: the whole radius comes back here
+    # and only the winners are hydrated (_hydrate_winners)
+    return db.session.execute(
+        select(*SNAPSHOT_COLUMNS).where(*eligibility_filter(), _EARTH_BOX),
+        {"req_lat": req_lat, "req_lon": req_lon, "radius_m": max_distance_km * 1000.0},
+    ).all()
+
+def _is_matchable(d, today=None, utc_today=None):
+    # rows written before register/edit canonicalised (or never migrated by init_db) may still
+    # hold free-text spellings; after the _BG_CANON warm-up this is one dict probe
+    dbg = canonical_blood(d.blood_group)
+    if dbg not in COMPATIBILITY or not is_eligible(d, today=today, utc_today=utc_today):
+        return None
+    return dbg
+
+# ---- process-local snapshot of matchable donors (no Postgres index to lean on) ----
+DONOR_CACHE_TTL = 60  # seconds; donor writes in app.py invalidate sooner
+
+_donor_cache = {"expires": 0.0, "snapshot": None}
+
+def invalidate_donor_cache():
+    _donor_cache["snapshot"] = None
+
+# only the columns matching reads; rows are plain tuples, not ORM instances
+SNAPSHOT_COLUMNS = (
+    Donor.id, Donor.blood_group, Donor.latitude, Donor.longitude, Donor.is_available, Donor.is_online,
+    Donor.weight_kg, Donor.age, Donor.dob, Donor.last_donation_date,
+)
+
+def _load_donor_snapshot():
+    # struct-of-arrays: one contiguous array per field instead of a list of Donor objects
+    ids, groups, lats, lons, online = [], [], [], [], []
+    # ids only for the rows SQL rules out; update_cached_donor needs to know they exist
+    ineligible = set(db.session.scalars(select(Donor.id)))
+    today, utc_today = date.today(), datetime.utcnow().date()
+    for d in db.session.execute(select(*SNAPSHOT_COLUMNS).where(*eligibility_filter())):
+        ineligible.discard(d.id)
+        dbg = _is_matchable(d, today, utc_today)
+        if dbg is None:
+            ineligible.add(d.id)
+            continue
+        if d.latitude is None or d.longitude is None:
+            continue
+        ids.append(d.id)
+        groups.append(dbg)
+        lats.append(d.latitude)
+        lons.append(d.longitude)
+        online.append(bool(d.is_online))
+    # sorted by latitude so a request only scans the latitude band its radius can reach
+    order = np.argsort(np.array(lats, dtype=np.float64), kind="stable")
+    ids = np.array(ids, dtype=np.int64)[order]
+    lats = np.array(lats, dtype=np.float64)[order]
+    lons = np.array(lons, dtype=np.float64)[order]
+    return {
+        "ids": ids,
+        "codes": group_codes(groups)[order],
+        # float32 for the radius pass: half the bytes, twice the SIMD lanes.
+        # Stored (3, N): one contiguous row per axis, so the pass is three flat 1-D gathers
+        "xyz": np.ascontiguousarray(unit_vectors(lats, lons).T, dtype=np.float32),
+        # exact degrees for the handful of donors that survive the radius cut
+        "lats": lats,
+        "lons": lons,
+        "online": np.array(online, dtype=bool)[order],
+        # band index: latitudes as loaded; "moved" holds donors that have shared a new position since
+        "lat_key": lats.copy(),
+        "moved": set(),
+        "pos": {int(donor_id): i for i, donor_id in enumerate(ids)},
+        "ineligible": ineligible,
+    }
+
+def donor_snapshot():
+    snap = _donor_cache["snapshot"]
+    now = time.monotonic()
+    if snap is None or now >= _donor_cache["expires"]:
+        snap = _load_donor_snapshot()
+        _donor_cache["snapshot"] = snap
+        _donor_cache["expires"] = now + DONOR_CACHE_TTL
+    return snap
+
+def update_cached_donor(donor_id, latitude=None, longitude=None, is_online=None):
+    # keep live location/presence in the snapshot without reloading it on every donor_share
+    snap = _donor_cache["snapshot"]
+    if snap is None:
+        return
+    i = snap["pos"].get(donor_id)
+    if i is None:
+        if donor_id not in snap["ineligible"]:
+            # new donor or first known location: it may be matchable now
+            invalidate_donor_cache()
+        return
+    if latitude is not None and longitude is not None:
+        snap["xyz"][:, i] = unit_vectors(latitude, longitude)[0]
+        snap["lats"][i] = latitude
+        snap["lons"][i] = longitude
+        snap["moved"].add(i)
+    if is_online is not None:
+        snap["online"][i] = is_online
+
+# ---- process-local snapshot of OPEN requests for the donor_share nearby scan ----
+OPEN_REQUEST_CACHE_TTL = 30  # seconds; status changes in app.py invalidate sooner
+
+_open_request_cache = {"expires": 0.0, "snapshot": None}
+
+def invalidate_open_requests():
+    _open_request_cache["snapshot"] = None
+
+def open_request_snapshot():
+    snap = _open_request_cache["snapshot"]
+    now = time.monotonic()
+    if snap is None or now >= _open_request_cache["expires"]:
+        rows = db.session.execute(
+            select(BloodRequest.id, BloodRequest.required_blood_group, BloodRequest.patient_name,
+                   BloodRequest.latitude, BloodRequest.longitude).where(BloodRequest.status == "OPEN")
+        ).all()
+        snap = {
+            "rows": rows,
+            "lats": np.array([r.latitude for r in rows], dtype=np.float64),
+            "lons": np.array([r.longitude for r in rows], dtype=np.float64),
+            "codes": group_codes([canonical_blood(r.required_blood_group) for r in rows]),
+        }
+        _open_request_cache["snapshot"] = snap
+        _open_request_cache["expires"] = now + OPEN_REQUEST_CACHE_TTL
+    return snap
+
+def open_requests_within(lat, lon, max_distance_km, recipient_groups=None):
+    snap = open_request_snapshot()
+    if not snap["rows"]:
+        return []
+    keep = np.ones(len(snap["rows"]), dtype=bool)
+    if recipient_groups is not None:
+        # drop requests the donor can't serve before any trig
+        keep &= group_lookup(recipient_groups)[snap["codes"]]
+    # bounding box around the donor: plain comparisons rule out almost every request
+    keep &= bounding_box_mask(lat, lon, max_distance_km, snap["lats"], snap["lons"])
+    idx = np.flatnonzero(keep)
+    if len(idx) == 0:
+        return []
+    near, dist = haversine_within(lat, lon, snap["lats"][idx], snap["lons"][idx], max_distance_km)
+    return [(snap["rows"][idx[i]], float(d)) for i, d in zip(near, dist)]
+
+def _rank(dist, online, max_results):
+    score = np.where(online, 1.3, 1.0) / (dist + 0.1)
+    order = np.arange(len(dist))
+    if len(order) > max_results:
+        # top-k without sorting the whole radius
+        order = np.argpartition(-score, max_results - 1)[:max_results]
+    return order[np.argsort(-score[order], kind="stable")], score
+
+def _hydrate_winners(winner_ids, order, dist, score):
+    # only the top-k winners are loaded as ORM objects, in one IN query
+    donors = {d.id: d for d in Donor.query.options(MATCH_LOAD).filter(Donor.id.in_(winner_ids))} if winner_ids else {}
+    return [(donors[donor_id], float(dist[i]), float(score[i])) for donor_id, i in zip(winner_ids, order) if donor_id in donors]
+
 def find_best_donors(required_group, req_lat, req_lon, max_results=10, max_distance_km=60):
     req_canon = canonical_blood(required_group)
     if not req_canon:
         return []
     compatible_groups = COMPATIBILITY.get(req_canon, [req_canon])
 
-    all_donors = Donor.query.all()
-    candidates = []
-    for d in all_donors:
-        try:
-            dbg = canonical_blood(d.blood_group)
-        except Exception:
-            dbg = None
-        if dbg not in compatible_groups:
-            continue
-        if not is_eligible(d):
-            continue
-        if d.latitude is None or d.longitude is None:
-            continue
-        dist = haversine_distance(req_lat, req_lon, d.latitude, d.longitude)
-        if dist > max_distance_km:
-            continue
-        score = 1.0 / (dist + 0.1)
-        if d.is_online:
-            score *= 1.3
-        candidates.append((d, dist, score))
-    candidates.sort(key=lambda x: x[2], reverse=True)
-    return candidates[:max_results]
+    if has_earthdistance():
+        today, utc_today = date.today(), datetime.utcnow().date()
+        pool = [d for d in candidate_donors(req_lat, req_lon, max_distance_km)
+                if d.latitude is not None and d.longitude is not None and _is_matchable(d, today, utc_today) in compatible_groups]
+        if not pool:
+            return []
+        n = len(pool)
+        lats = np.fromiter((d.latitude for d in pool), dtype=np.float64, count=n)
+        lons = np.fromiter((d.longitude for d in pool), dtype=np.float64, count=n)
+        online = np.fromiter((bool(d.is_online) for d in pool), dtype=bool, count=n)
+        near, dist = haversine_within(req_lat, req_lon, lats, lons, max_distance_km)
+        order, score = _rank(dist, online[near], max_results)
+        return _hydrate_winners([pool[near[i]].id for i in order], order, dist, score)
+
+    snap = donor_snapshot()
+    # latitude band of the radius via binary search, plus anyone who moved since the load
+    lat_span = math.degrees(max_distance_km / EARTH_RADIUS_KM)
+    lo = np.searchsorted(snap["lat_key"], req_lat - lat_span, side="left")
+    hi = np.searchsorted(snap["lat_key"], req_lat + lat_span, side="right")
+    band = np.arange(lo, hi)
+    moved = tuple(snap["moved"])
+    if moved:
+        band = np.union1d(band, np.fromiter(moved, dtype=np.int64, count=len(moved)))
+    idx = band[group_lookup(compatible_groups)[snap["codes"][band]]]
+    if len(idx) == 0:
+        return []
+    # squared chord length grows monotonically with great-circle distance, so the radius
+    # cut needs no trig. It runs in float32 (~1 m of error), so it is slightly widened here
+    # and the exact float64 haversine makes the final cut on the few donors that pass
+    qx, qy, qz = unit_vectors(req_lat, req_lon)[0].astype(np.float32)
+    x, y, z = snap["xyz"]
+    dx, dy, dz = x[idx] - qx, y[idx] - qy, z[idx] - qz
+    chord2 = dx * dx + dy * dy + dz * dz
+    max_chord2 = (2 * math.sin(max_distance_km / (2 * EARTH_RADIUS_KM))) ** 2
+    near = idx[chord2 <= max_chord2 * (1 + 1e-3) + 1e-9]
+    inside, dist = haversine_within(req_lat, req_lon, snap["lats"][near], snap["lons"][near], max_distance_km)
+    near = near[inside]
+    # back to id order so ties rank the same way as a table scan
+    by_id = np.argsort(snap["ids"][near], kind="stable")
+    near, dist = near[by_id], dist[by_id]
+    order, score = _rank(dist, snap["online"][near], max_results)
+    return _hydrate_winners([int(snap["ids"][near[i]]) for i in order], order, dist, score)
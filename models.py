@@ -34,6 +34,11 @@ class Donor(db.Model):
     photo = db.Column(db.String(256), nullable=True)
     residential_area = db.Column(db.String(256), nullable=True)
 
+    __table_args__ = (
+        db.Index("ix_donor_blood_group", "blood_group", "id"),  # admin donor list filter, keyset on id
+        db.Index("ix_donor_online", "is_online"),              # online donor counter
+    )
+
 class BloodRequest(db.Model):
     __tablename__ = "blood_request"
     id = db.Column(db.Integer, primary_key=True)
@@ -47,6 +52,14 @@ class BloodRequest(db.Model):
     accepted_donor_id = db.Column(db.Integer, db.ForeignKey("donor.id"), nullable=True)
     assigned_at = db.Column(db.DateTime, nullable=True)
 
+    accepted_donor = db.relationship("Donor", foreign_keys=[accepted_donor_id])
+
+    __table_args__ = (
+        db.Index("ix_blood_request_created_at", "created_at"),             # hospital/admin lists, newest first
+        db.Index("ix_blood_request_status_created", "status", "created_at"),  # OPEN scans
+        db.Index("ix_blood_request_donor_created", "accepted_donor_id", "created_at"),  # donor dashboard
+    )
+
 class Notification(db.Model):
     __tablename__ = "notification"
     id = db.Column(db.Integer, primary_key=True)
@@ -56,3 +69,9 @@ class Notification(db.Model):
     notif_type = db.Column(db.String(64), default="REQUEST")
     payload = db.Column(db.String(1024), nullable=True)
     delivered = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (
+        db.Index("ix_notification_created_at", "created_at"),                 # staff notification tail
+        db.Index("ix_notification_donor_created", "donor_id", "created_at"),  # per-donor tail
+        db.Index("ix_notification_donor_request", "donor_id", "request_id"),  # notification dedupe lookups
+    )